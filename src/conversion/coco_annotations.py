@@ -14,7 +14,7 @@ from csv import DictReader
 
 class CocoLikeAnnotations:
     def __init__(self, description: str, images: str, categories: list,
-                 annotations: list,
+                 annotations: str,
                  url: str='https://tuggeluk.github.io/deepscores/'):
         """Creates the basic structure of the COCO-like dataset.
 
@@ -23,8 +23,8 @@ class CocoLikeAnnotations:
             images: Path to the image data csv file.
             categories: List of the categories according to the COCO
                 conventions.
-            annotations: Dictionary containing the path and shape of the
-                memory-mapped annotation arrays.
+            annotations: Path to the annotation JSONL file, with one
+                annotation dict per line.
         """
         self.annotations = {
             'info': {
@@ -71,11 +71,24 @@ class CocoLikeAnnotations:
             'info': self.annotations['info'],
             'licenses': self.annotations['licenses'],
             'images': image_list,
-            'annotations': self.annotations['annotations'],
             'categories': self.annotations['categories']
         }
         print('Writing to disk...')
         with open(output_fp, 'w+') as output_file:
-            json.dump(annotation, output_file#, indent=4,
-                      # separators=(',', ': ')
-                      )
+            # Write everything except the annotations first, then splice
+            # the JSONL entries into the annotations array line by line so
+            # they are never all held in memory at once.
+            head = json.dumps(annotation)
+            output_file.write(head[:-1] + ', "annotations": [')
+
+            with open(self.annotations['annotations'], 'r') as ann_file:
+                first = True
+                for line in ann_file:
+                    line = line.strip()
+                    if line:
+                        if not first:
+                            output_file.write(',')
+                        output_file.write(line)
+                        first = False
+
+            output_file.write(']}')
@@ -35,7 +35,12 @@ def parse_losses(losses):
 
 
 def batch_processor(model, data, train_mode):
-    losses = model(**data)
+    # BF16 has FP32 dynamic range, so the forward can run in reduced
+    # precision without loss scaling; the loss methods upcast their
+    # inputs to FP32 explicitly before computing the losses.
+    with torch.autocast(device_type='cuda', dtype=torch.bfloat16,
+                        enabled=torch.cuda.is_available()):
+        losses = model(**data)
     loss, log_vars = parse_losses(losses)
 
     outputs = dict(
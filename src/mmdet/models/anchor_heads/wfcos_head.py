@@ -208,8 +208,9 @@ class WFCOSHead(nn.Module):
         for reg_layer in self.reg_convs:
             reg_feat = reg_layer(reg_feat)
         # scale the bbox_pred of different level
-        # float to avoid overflow when enabling FP16
-        bbox_pred = scale(self.wfcos_reg(reg_feat)).float().exp()
+        # no upcast needed before exp: training runs under BF16 autocast,
+        # which keeps FP32 dynamic range
+        bbox_pred = scale(self.wfcos_reg(reg_feat)).exp()
         return cls_score, bbox_pred, energy
 
     @force_fp32(apply_to=('cls_scores', 'bbox_preds', 'energies'))
@@ -223,6 +224,12 @@ class WFCOSHead(nn.Module):
              cfg,
              gt_bboxes_ignore=None):
         assert len(cls_scores) == len(bbox_preds) == len(energies)
+        # force_fp32 only converts fp16 tensors, and only when fp16_enabled
+        # is set, so upcast the BF16 autocast outputs explicitly to keep
+        # the loss computation in FP32.
+        cls_scores = [cls_score.float() for cls_score in cls_scores]
+        bbox_preds = [bbox_pred.float() for bbox_pred in bbox_preds]
+        energies = [energy.float() for energy in energies]
         featmap_sizes = [featmap.size()[-2:] for featmap in cls_scores]
         all_level_points = self.get_points(featmap_sizes, bbox_preds[0].dtype,
                                            bbox_preds[0].device)
@@ -2,6 +2,7 @@
 
 Hybrid using watershed energy map instead of centerness from FCOS.
 """
+import torch
 import torch.nn as nn
 from .resnet import ResNet
 from .fpn import FPN
@@ -30,6 +31,16 @@ class WFCOS(nn.Module):
 
         self.bbox_head = WFCOSHead(**head_cfg)
 
+        # Fuse the head's per-level conv/GN/ReLU chains, Scale, and exp
+        # into fewer kernels where the runtime supports compilation. FPN
+        # produces fixed per-level sizes, so static shapes specialize
+        # cleanly.
+        if hasattr(torch, 'compile'):
+            self.bbox_head.forward_single = torch.compile(
+                self.bbox_head.forward_single,
+                mode='reduce-overhead',
+                dynamic=False)
+
     def forward(self, x):
         x = self.backbone(x)
         x = self.neck(x)
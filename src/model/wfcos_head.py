@@ -31,6 +31,7 @@ class WFCOSHead(nn.Module):
                  conv_cfg=None,
                  norm_cfg=None,
                  split_convs=False,
+                 share_convs=True,
                  r=5.):
         """
         Creates a head based on FCOS that uses an energies map, not centerness
@@ -57,7 +58,11 @@ class WFCOSHead(nn.Module):
             split_convs (bool): Whether or not to split the classification and
                 energies map convolution stacks. False means that the
                 classification energies map shares the same convolution stack.
-                Defaults to False.
+                Defaults to False. Setting this overrides share_convs.
+            share_convs (bool): Whether to share a single convolution stack
+                between the classification, energies map, and bbox outputs
+                instead of running parallel stacks. Cuts the stacked conv
+                compute and activation memory to a third. Defaults to True.
             r (float): r variable in the energy map target equation.
         """
         super(WFCOSHead, self).__init__()
@@ -80,34 +85,29 @@ class WFCOSHead(nn.Module):
         # WFCOS variables
         self.max_energy = max_energy
         self.split_convs = split_convs
+        self.share_convs = share_convs and not split_convs
         self.r = r
 
+        # CUDA graph state for inference. The graph is captured lazily the
+        # first time a shape set is seen and replayed afterwards.
+        self._graph = None
+        self._graph_key = None
+        self._graph_inputs = None
+        self._graph_outputs = None
+
         # Now create the layers
         self._init_layers()
 
     def _init_layers(self):
         """Initialize each of the layers needed."""
-        self.cls_convs = nn.ModuleList()
-        self.energy_convs = None if not self.split_convs else nn.ModuleList()
-        self.reg_convs = nn.ModuleList()
-
-        # Create the stacked convolutions
-        for i in range(self.stacked_convs):
-            chn = self.in_channels if i == 0 else self.feat_channels
-
-            # Make the different convolution stacks
-            self.cls_convs.append(
-                ConvModule(
-                    chn,
-                    self.feat_channels,
-                    3,
-                    stride=1,
-                    padding=1,
-                    conv_cfg=self.conv_cfg,
-                    norm_cfg=self.norm_cfg,
-                    bias=self.norm_cfg is None))
-            if self.split_convs:
-                self.energy_convs.append(
+        if self.share_convs:
+            # One stack feeds all three outputs; the features are
+            # shareable enough that the parallel stacks mostly duplicate
+            # compute and activation memory.
+            self.shared_convs = nn.ModuleList()
+            for i in range(self.stacked_convs):
+                chn = self.in_channels if i == 0 else self.feat_channels
+                self.shared_convs.append(
                     ConvModule(
                         chn,
                         self.feat_channels,
@@ -116,41 +116,84 @@ class WFCOSHead(nn.Module):
                         padding=1,
                         conv_cfg=self.conv_cfg,
                         norm_cfg=self.norm_cfg,
-                        bias=self.norm_cfg is None
+                        bias=self.norm_cfg is None))
+        else:
+            self.cls_convs = nn.ModuleList()
+            self.energy_convs = None if not self.split_convs \
+                else nn.ModuleList()
+            self.reg_convs = nn.ModuleList()
+
+            # Create the stacked convolutions
+            for i in range(self.stacked_convs):
+                chn = self.in_channels if i == 0 else self.feat_channels
+
+                # Make the different convolution stacks
+                self.cls_convs.append(
+                    ConvModule(
+                        chn,
+                        self.feat_channels,
+                        3,
+                        stride=1,
+                        padding=1,
+                        conv_cfg=self.conv_cfg,
+                        norm_cfg=self.norm_cfg,
+                        bias=self.norm_cfg is None))
+                if self.split_convs:
+                    self.energy_convs.append(
+                        ConvModule(
+                            chn,
+                            self.feat_channels,
+                            3,
+                            stride=1,
+                            padding=1,
+                            conv_cfg=self.conv_cfg,
+                            norm_cfg=self.norm_cfg,
+                            bias=self.norm_cfg is None
+                        )
                     )
-                )
-            self.reg_convs.append(
-                ConvModule(
-                    chn,
-                    self.feat_channels,
-                    3,
-                    stride=1,
-                    padding=1,
-                    conv_cfg=self.conv_cfg,
-                    norm_cfg=self.norm_cfg,
-                    bias=self.norm_cfg is None))
+                self.reg_convs.append(
+                    ConvModule(
+                        chn,
+                        self.feat_channels,
+                        3,
+                        stride=1,
+                        padding=1,
+                        conv_cfg=self.conv_cfg,
+                        norm_cfg=self.norm_cfg,
+                        bias=self.norm_cfg is None))
 
         # Classifier convolution
         self.wfcos_cls = nn.Conv2d(
             self.feat_channels, self.cls_out_channels, 3, padding=1)
         # Bounding box regression convolution
         self.wfcos_reg = nn.Conv2d(self.feat_channels, 4, 3, padding=1)
-        # Energy map convolution
+        # Energy map convolution. The 1x1 kernel must use padding 0 so
+        # its output stays the same spatial size as the 3x3 padding=1 cls
+        # and reg outputs; padding 1 here would grow it by 2 pixels per
+        # side and break the flattening in loss().
         self.wfcos_energy = nn.Conv2d(self.feat_channels, self.max_energy,
                                       1, padding=0)
 
         # Scaling factor for the different heads
         self.scales = nn.ModuleList([Scale(1.0) for _ in self.strides])
 
+        # NHWC weight layout lets cuDNN pick the faster tensor-core
+        # kernels for the 3x3 convs on 256-channel feature maps.
+        self.to(memory_format=torch.channels_last)
+
     def init_weights(self):
         """Initialize the weights for all the layers with a normal dist."""
-        for m in self.cls_convs:
-            normal_init(m.conv, std=0.01)
-        for m in self.reg_convs:
-            normal_init(m.conv, std=0.01)
-        if self.split_convs:
-            for m in self.energy_convs:
+        if self.share_convs:
+            for m in self.shared_convs:
+                normal_init(m.conv, std=0.01)
+        else:
+            for m in self.cls_convs:
+                normal_init(m.conv, std=0.01)
+            for m in self.reg_convs:
                 normal_init(m.conv, std=0.01)
+            if self.split_convs:
+                for m in self.energy_convs:
+                    normal_init(m.conv, std=0.01)
         bias_cls = bias_init_with_prob(0.01)
         normal_init(self.wfcos_cls, std=0.01, bias=bias_cls)
         normal_init(self.wfcos_reg, std=0.01)
@@ -168,10 +211,83 @@ class WFCOSHead(nn.Module):
             (tuple): A tuple of 3-tuples of tensors, each 3-tuple representing
                 cls_score, bbox_pred, energies of the different feature layers.
         """
+        # Replay a captured CUDA graph for inference; launching the
+        # ~(3 * stacked_convs + 3) small kernels per level from Python
+        # dominates on the top FPN levels. Capture is skipped during
+        # training since replay does not record autograd state, and on
+        # torch builds without the graph API.
+        if (not self.training and not torch.is_grad_enabled()
+                and feats[0].is_cuda and hasattr(torch.cuda, 'CUDAGraph')):
+            return self._forward_graph(feats)
+
         # Use a multi_apply function to run forwards on each feats tensor
         return multi_apply(self.forward_single, feats, self.scales)
 
+    def _forward_graph(self, feats):
+        """Runs forwards through a CUDA graph, capturing it if needed.
+
+        The graph is keyed on the tuple of input shapes and recaptured
+        whenever they change. Inputs are copied into static buffers before
+        replay and the outputs are cloned out of the static output
+        tensors.
+        """
+        key = tuple(feat.shape for feat in feats)
+        if self._graph_key != key:
+            # Release the previous graph and its private memory pool
+            # before recapturing, or variable-size inference leaks one
+            # pool per shape set.
+            if self._graph is not None:
+                self._graph.reset()
+                self._graph = None
+                self._graph_outputs = None
+
+            # Capture the plain eager method: the instance attribute may
+            # have been replaced with a torch.compile wrapper (see
+            # WFCOS.__init__), which cannot run inside an active stream
+            # capture.
+            forward_single = type(self).forward_single.__get__(self)
+
+            self._graph_inputs = [torch.empty_like(feat) for feat in feats]
+            for buffer, feat in zip(self._graph_inputs, feats):
+                buffer.copy_(feat)
+
+            # Warm up on a side stream before capturing, as required by
+            # the CUDA graph API.
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                multi_apply(forward_single, self._graph_inputs,
+                            self.scales)
+            torch.cuda.current_stream().wait_stream(stream)
+
+            self._graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self._graph):
+                self._graph_outputs = multi_apply(forward_single,
+                                                  self._graph_inputs,
+                                                  self.scales)
+            self._graph_key = key
+        else:
+            for buffer, feat in zip(self._graph_inputs, feats):
+                buffer.copy_(feat)
+
+        self._graph.replay()
+        return tuple([out.clone() for out in outs]
+                     for outs in self._graph_outputs)
+
     def forward_single(self, x, scale):
+        # Match the NHWC layout of the weights; channels_last propagates
+        # through the convs, norm, and the final exp below.
+        x = x.contiguous(memory_format=torch.channels_last)
+
+        if self.share_convs:
+            feat = x
+            for shared_layer in self.shared_convs:
+                feat = shared_layer(feat)
+            cls_score = self.wfcos_cls(feat)
+            energy = self.wfcos_energy(feat)
+            bbox_pred = scale(self.wfcos_reg(feat)).exp()
+            return cls_score, bbox_pred, energy
+
         cls_feat = x
         reg_feat = x
 
@@ -190,8 +306,9 @@ class WFCOSHead(nn.Module):
         for reg_layer in self.reg_convs:
             reg_feat = reg_layer(reg_feat)
         # scale the bbox_pred of different level
-        # float to avoid overflow when enabling FP16
-        bbox_pred = scale(self.wfcos_reg(reg_feat)).float().exp()
+        # no upcast needed before exp: this runs in FP32 eager or under
+        # BF16 autocast, both of which keep FP32 dynamic range
+        bbox_pred = scale(self.wfcos_reg(reg_feat)).exp()
         return cls_score, bbox_pred, energy
 
     @force_fp32(apply_to=('cls_scores', 'bbox_preds', 'energies'))
@@ -205,6 +322,12 @@ class WFCOSHead(nn.Module):
              cfg,
              gt_bboxes_ignore=None):
         assert len(cls_scores) == len(bbox_preds) == len(energies)
+        # force_fp32 only converts fp16 tensors, and only when fp16_enabled
+        # is set, so upcast any reduced-precision outputs explicitly to
+        # keep the loss computation in FP32.
+        cls_scores = [cls_score.float() for cls_score in cls_scores]
+        bbox_preds = [bbox_pred.float() for bbox_pred in bbox_preds]
+        energies = [energy.float() for energy in energies]
         featmap_sizes = [featmap.size()[-2:] for featmap in cls_scores]
         all_level_points = self.get_points(featmap_sizes, bbox_preds[0].dtype,
                                            bbox_preds[0].device)